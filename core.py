@@ -1,6 +1,7 @@
 import zlib
 import json
 import base58
+import orjson
 import socket
 import asyncio
 import hashlib as hlib
@@ -11,10 +12,14 @@ from typing import Union, Optional, Dict, List
 from dataclasses import dataclass, asdict, field
 
 from Crypto.Cipher import AES
-from sympy.ntheory import isprime
 from ecdsa import SigningKey, VerifyingKey, SECP256k1
 
 
+def pack(data_dict):
+    data_json = orjson.dumps(data_dict)
+    return zlib.compress(data_json)
+
+
 @dataclass
 class DataHashable:
     hash: Optional[str]
@@ -31,9 +36,26 @@ class DataHashable:
         return self_dict
 
     def dict_verify(self):
-        return self.hash == self.dict_hash()
+        return self.hash == self._dict_hash()
 
     def dict_hash(self):
+        # cached until object is mutated, see dict_hash_reset
+        if vars(self).get('_hash') is None:
+            self._hash = self._dict_hash()
+        return self._hash
+
+    def dict_hash_reset(self):
+        self._hash = None
+        self._wire = {}
+
+    def to_wire(self, key):
+        # cached until object is mutated, see dict_hash_reset
+        wire = vars(self).setdefault('_wire', {})
+        if key not in wire:
+            wire[key] = pack({key: self.to_dict()})
+        return wire[key]
+
+    def _dict_hash(self):
         self_dict = self.to_dict_without_hash()
         self_json = json.dumps(self_dict).encode()
         return hlib.sha3_256(self_json).hexdigest()
@@ -63,6 +85,7 @@ class DataSignable(DataHashable):
     def dict_sign(self, user, password):
         self_dict = self.to_dict_without_sign()
         self.sign = user.sign(json.dumps(self_dict).encode(), password)
+        self.dict_hash_reset()
         self.hash = self.dict_hash()
         return self.sign
 
@@ -114,6 +137,10 @@ class User(DataHashable):
 
         return User(priv=e_priv, pub=pub, hash=None)
 
+    @classmethod
+    def from_dict(cls, d):
+        return cls(priv=d['priv'], pub=d['pub'], hash=d['hash'])
+
     def check_passwd(self, password):
         self._decrypt_priv(self.priv, password)
         return password
@@ -161,10 +188,23 @@ class Transaction(DataTimestamp, DataSignable):
     to_adr: str
     act: Union[Invoice, Payment, Reward, Message]
 
+    ACT_TYPES = {'ivc': Invoice, 'pay': Payment, 'rew': Reward, 'msg': Message}
+
     def __post_init__(self):
         super(Transaction, self).__post_init__()
         super(DataTimestamp, self).__post_init__()
 
+    @classmethod
+    def from_dict(cls, d):
+        act_keys = Transaction.ACT_TYPES.keys() & d['act'].keys()
+        if len(act_keys) != 1:
+            raise ValueError(f'unknown transaction action: {d["act"]}')
+        act_type = Transaction.ACT_TYPES[act_keys.pop()]
+
+        trans = cls(from_adr=d['from_adr'], to_adr=d['to_adr'], act=act_type(**d['act']), hash=d['hash'], sign=d['sign'])
+        trans.time = d['time']
+        return trans
+
 
 @dataclass
 class ProofOfWork:
@@ -174,6 +214,10 @@ class ProofOfWork:
     def __post_init__(self):
         self.block = None
 
+    @classmethod
+    def from_dict(cls, d):
+        return cls(solver=d['solver'], work=d['work'])
+
     @staticmethod
     def defact(factors):
         return reduce(lambda prev, factor: prev * (int(factor[0]) ** factor[1]), factors.items(), 1)
@@ -182,7 +226,8 @@ class ProofOfWork:
         self.block = block
 
     def add_pow(self, num, factors):
-        self.work[num] = factors
+        # numbers exceed 64 bits, keep them as strings like json does
+        self.work[str(num)] = {str(p): e for p, e in factors.items()}
 
     def extract(self, i):
         data = self.block.to_dict_without_hash()
@@ -192,6 +237,9 @@ class ProofOfWork:
         return int.from_bytes(h[0:self.block.h_diff], byteorder='little')
 
     def work_check_h(self, i):
+        # sympy is heavy, import it only when checking work
+        from sympy.ntheory import isprime
+
         num = self.extract(i)
         factors = list(self.work.items())[i][1]
 
@@ -217,15 +265,26 @@ class Block(DataTimestamp, DataHashable):
         super(Block, self).__post_init__()
         super(DataTimestamp, self).__post_init__()
 
+    @classmethod
+    def from_dict(cls, d):
+        trans = {h: Transaction.from_dict(t) for h, t in d['trans'].items()}
+
+        block = cls(prev=d['prev'], h_diff=d['h_diff'], trans=trans, pow=ProofOfWork.from_dict(d['pow']), hash=d['hash'])
+        block.v_diff = d['v_diff']
+        block.time = d['time']
+        return block
+
     def get_v_diff(self):
         return max(1, 2 ** (13 - 3 * self.h_diff // 8))
 
     def add_trans(self, trans):
         self.trans[trans.dict_hash()] = trans
+        self.dict_hash_reset()
         self.hash = self.dict_hash()
 
     def add_pow(self, num, factors):
         self.pow.add_pow(num, factors)
+        self.dict_hash_reset()
         self.hash = self.dict_hash()
 
     def work_check(self):
@@ -265,6 +324,14 @@ class Blockchain(DataHashable):
         self.blocks_cache = {}
         super().__post_init__()
 
+    @classmethod
+    def from_dict(cls, d):
+        blocks = {h: Block.from_dict(b) for h, b in d['blocks'].items()}
+
+        chain = cls(ver=d['ver'], blocks=blocks, hash=d['hash'])
+        chain.coin = d['coin']
+        return chain
+
     def new_block(self, solver):
         prev = self.last_block()
         h_diff = self.get_h_diff(prev)
@@ -432,23 +499,29 @@ class Net(DataHashable):
         self.ipv6 = self.get_ipv6()
         self.hlr = None
         self.serv = None
+        self.peers_index = {(p.ipv6, p.port) for p in self.peers}
         super().__post_init__()
 
+    @classmethod
+    def from_dict(cls, d):
+        return cls(peers=[Peer(p['ipv6'], p['port']) for p in d['peers']], hash=d['hash'])
+
     def serv_init(self, hlr):
         self.serv = asyncio.start_server(self.recv, '::0', 10000, family=socket.AF_INET6)
         self.hlr = hlr
 
     def add_peer(self, peer):
         self.peers.append(peer)
+        self.peers_index.add((peer.ipv6, peer.port))
 
     def update_peer(self, peer):
-        uniq = not any(p == peer for p in self.peers)
+        uniq = (peer.ipv6, peer.port) not in self.peers_index
         if uniq:
             self.add_peer(peer)
         return uniq
 
     def update_peers(self, peers):
-        return reduce(lambda u, p: u or self.update_peer(p), peers, False)
+        return any([self.update_peer(p) for p in peers])
 
     def get_ipv6(self):
         # google dns
@@ -457,9 +530,9 @@ class Net(DataHashable):
             return sock.getsockname()[0]
 
     async def send(self, data_dict):
-        data_json = json.dumps(data_dict).encode()
-        data_comp = zlib.compress(data_json)
+        await self.send_raw(pack(data_dict))
 
+    async def send_raw(self, data_comp):
         for peer in self.peers:
             if peer.ipv6 == self.ipv6:
                 await asyncio.sleep(0)
@@ -483,7 +556,7 @@ class Net(DataHashable):
                 break
             data_comp += tmp
 
-        data_json = zlib.decompress(data_comp).decode()
-        data = json.loads(data_json)
-    
+        data_json = zlib.decompress(data_comp)
+        data = orjson.loads(data_json)
+
         await self.hlr(data)
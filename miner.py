@@ -1,20 +1,36 @@
 import asyncio
-from sympy.ntheory import factorint
+from concurrent.futures import ProcessPoolExecutor
 
 
 class MinerBackend:
     MINER_BACKEND_SYMPY = 'sympy'
+    MINER_BACKEND_SYMPY_PROCESS = 'sympy-process'
 
     def __init__(self, backend):
         self.backend = backend
+        self.executor = None
 
     async def factorint(self, num):
+        # sympy is heavy, import it only when mining
+        from sympy.ntheory import factorint
+
         loop = asyncio.get_running_loop()
 
         if self.backend == MinerBackend.MINER_BACKEND_SYMPY:
             return await loop.run_in_executor(None, factorint, num)
+
+        # factorize outside of interpreter lock, so event loop keeps serving
+        if self.backend == MinerBackend.MINER_BACKEND_SYMPY_PROCESS:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=1)
+            return await loop.run_in_executor(self.executor, factorint, num)
         raise NotImplementedError()
 
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
 
 class Miner:
     def __init__(self, backend=MinerBackend.MINER_BACKEND_SYMPY, block=None):
@@ -24,6 +40,9 @@ class Miner:
     def set_block(self, block):
         self.block = block
 
+    def shutdown(self):
+        self.backend.shutdown()
+
     async def work(self):
         for i in range(self.block.v_diff):
             num = self.block.pow.extract(i)
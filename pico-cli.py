@@ -1,65 +1,128 @@
-import json
+import orjson
+import hashlib
 import argparse
 import asyncio
-import os.path
+import os
 
 from getpass import getpass
-from aiofile import async_open
+from dataclasses import asdict
 
-from dacite import from_dict
-
-from miner import Miner
+from miner import Miner, MinerBackend
 from core import User, Peer, Net, Transaction, Invoice, Payment, Message, Reward, Block, Blockchain, BlockCheck
 
 
+# transaction action constructors and argument parsers
+ACT_CTORS = {
+    'ivc': (Invoice, int),
+    'pay': (Payment, int),
+    'msg': (Message, str)
+}
+
+
 class CLI:
+    # serializes writers, so snapshots hit the disk in order
+    disk_lock = asyncio.Lock()
+
     def __init__(self):
         self.net = None
         self.usr = None
         self.chain = None
+        self.chain_log = None
+
+    @staticmethod
+    def _write(path, data):
+        # write to temporary file and atomically replace target
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _append(path, data):
+        with open(path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _read(path):
+        with open(path, 'rb') as f:
+            return f.read()
 
     @staticmethod
     async def _dict_to_disk(obj, obj_path):
-        async with async_open(obj_path, 'w') as f:
-            obj_json = json.dumps(obj.to_dict(), indent=4)
-            await f.write(obj_json)
+        async with CLI.disk_lock:
+            obj_json = orjson.dumps(obj.to_dict(), option=orjson.OPT_INDENT_2)
+            await asyncio.to_thread(CLI._write, obj_path, obj_json)
 
     @staticmethod
     async def _dict_from_disk(obj_path):
-        async with async_open(obj_path, 'r') as f:
-            return json.loads(await f.read())
+        return orjson.loads(await asyncio.to_thread(CLI._read, obj_path))
+
+    @staticmethod
+    async def _block_to_log(block, log_path):
+        async with CLI.disk_lock:
+            block_json = orjson.dumps(block.to_dict()) + b'\n'
+            await asyncio.to_thread(CLI._append, log_path, block_json)
+
+    @staticmethod
+    async def _blocks_from_log(log_path):
+        if not os.path.exists(log_path):
+            return []
+
+        blocks = []
+        for line in (await asyncio.to_thread(CLI._read, log_path)).splitlines():
+            try:
+                blocks.append(Block.from_dict(orjson.loads(line)))
+            except orjson.JSONDecodeError:
+                # skip partially written block
+                break
+        return blocks
 
     @staticmethod
-    def _init_ser_obj(obj_path, obj_reader, obj_maker):
+    async def _init_ser_obj(obj_path, obj_reader, obj_maker):
         obj = None
         if os.path.exists(obj_path):
-            obj = obj_reader(asyncio.run(CLI._dict_from_disk(obj_path)))
+            obj = obj_reader(await CLI._dict_from_disk(obj_path))
         else:
             obj = obj_maker()
-            asyncio.run(CLI._dict_to_disk(obj, obj_path))
+            await CLI._dict_to_disk(obj, obj_path)
         return obj
 
-    def net_init(self, peers_path):
+    async def net_init(self, peers_path):
         def maker():
             net = Net(hash=None)
             net.add_peer(Peer('2002:c257:6f39::1', 10000))
             net.add_peer(Peer('2002:c257:65d4::1', 10000))
             return net
 
-        reader = lambda d: from_dict(Net, d)
-        self.net = CLI._init_ser_obj(peers_path, reader, maker)
-        self.update_self_peer()
+        reader = Net.from_dict
+        self.net = await CLI._init_ser_obj(peers_path, reader, maker)
+        await self.update_self_peer()
 
-    def usr_init(self, usr_path):
+    async def usr_init(self, usr_path):
         reader = CLI.usr_login
         maker = CLI.usr_reg
-        self.usr = CLI._init_ser_obj(usr_path, reader, maker)
+        self.usr = await CLI._init_ser_obj(usr_path, reader, maker)
 
-    def chain_init(self, chain_path):
+    async def chain_init(self, chain_path):
         # FIXME: fetch blockchain from another node
-        reader = lambda d: from_dict(Blockchain, d)
+        reader = Blockchain.from_dict
         maker = lambda: Blockchain(ver='0.1', blocks={}, hash=None)
-        self.chain = CLI._init_ser_obj(chain_path, reader, maker)
+        self.chain = await CLI._init_ser_obj(chain_path, reader, maker)
+        self.chain_log = f'{chain_path}.log'
+
+        # replay accepted blocks, they were checked before logging
+        blocks = await CLI._blocks_from_log(self.chain_log)
+        for block in blocks:
+            self.chain.blocks.setdefault(block.dict_hash(), block)
+
+        # fold log into blockchain, also drops torn tail so next append starts clean
+        if os.path.exists(self.chain_log):
+            await CLI._dict_to_disk(self.chain, chain_path)
+            await asyncio.to_thread(os.remove, self.chain_log)
 
     @staticmethod
     def act_with_passwd(act):
@@ -69,7 +132,8 @@ class CLI:
                 return act(passwd)
             except KeyboardInterrupt:
                 exit()
-            except Exception:
+            except ValueError:
+                # private key authentication tag mismatch
                 print('Invalid password!')
 
     @staticmethod
@@ -91,24 +155,26 @@ class CLI:
 
     @staticmethod
     def usr_login(usr_dict):
-        return from_dict(User, usr_dict)
+        return User.from_dict(usr_dict)
 
     @staticmethod
     def usr_reg():
         print('No user presented, register new one.')
         return User.create(CLI.gen_passwd())
 
-    def make_trans(self, trans):
+    async def make_trans(self, trans):
         ans = input('Do u want to make a transaction? [y/n]: ')
         if ans in ('y', 'Y'):
             trans.sign(self.usr, self.passwd())
-            asyncio.run(self.net.send({'trans': trans.to_dict()}))
+            await self.net.send_raw(trans.to_wire('trans'))
             print(trans.to_dict())
 
-    def update_self_peer(self):
+    async def update_self_peer(self):
         self.net.update_peer(Peer(self.net.ipv6, 10000))
-        asyncio.run(self.net.send(self.net.to_dict()))
-        asyncio.run(self._dict_to_disk(self.net, 'peers.json'))
+        await asyncio.gather(
+            self.net.send(self.net.to_dict()),
+            self._dict_to_disk(self.net, 'peers.json')
+        )
 
 
 class CoreServer(CLI):
@@ -116,81 +182,108 @@ class CoreServer(CLI):
         super().__init__()
 
     async def update_peers_hlr(self, peers_dict):
-        peers = [Peer(peer['ipv6'], peer['port']) for peer in peers_dict]
+        peers = list({(peer['ipv6'], peer['port']): Peer(peer['ipv6'], peer['port']) for peer in peers_dict}.values())
 
         if self.net.update_peers(peers):
             print('Peers updated.')
 
-            await self.net.send({'peers': peers_dict})
-            await self._dict_to_disk(self.net, 'peers.json')
+            await asyncio.gather(
+                self.net.send({'peers': [asdict(peer) for peer in peers]}),
+                self._dict_to_disk(self.net, 'peers.json')
+            )
 
     async def add_block_hlr(self, block_dict):
-        block = from_dict(Block, block_dict)
+        block = Block.from_dict(block_dict)
 
         if self.chain.check_block(block) is BlockCheck.OK:
-            await self.net.send({'block': block.to_dict()})
+            await self.net.send_raw(block.to_wire('block'))
 
         if self.chain.add_block(block):
-            await self._dict_to_disk(self.chain, 'blockchain.json')
+            await self._block_to_log(block, self.chain_log)
 
     async def serve_dispatch(self, data):
-        hlr_map = {
-            'peers': self.update_peers_hlr,
-            'block': self.add_block_hlr
-        }
+        if (peers := data.get('peers')) is not None:
+            await self.update_peers_hlr(peers)
 
-        for key, hlr in hlr_map.items():
-            if data.get(key):
-                await hlr(data[key])
+        if (block := data.get('block')) is not None:
+            await self.add_block_hlr(block)
 
     async def serve_forever(self):
         self.net.serv_init(self.serve_dispatch)
 
-        loop = asyncio.get_running_loop()
-        loop.create_task(self.net.serv)
-
-        while True:
-            await asyncio.sleep(0)
+        serv = await self.net.serv
+        async with serv:
+            await serv.serve_forever()
 
 
 class MiningServer(CoreServer):
-    def __init__(self):
+    TRANS_CACHE_MAX = 100000
+
+    def __init__(self, backend=MinerBackend.MINER_BACKEND_SYMPY_PROCESS):
         super().__init__()
         self.block = None
-        self.miner = Miner()
-        self.trans_cache = []
+        self.miner = Miner(backend)
+        self.mining = None
+        self.disk_tasks = set()
+        self.block_settled = asyncio.Event()
+        self.trans_cache = {}
+        self.trans_seen = {}
 
     def cache_trans(self, trans):
-        print(f'Transaction {trans.dict_hash()[0:12]} will be in next block.')
-        self.trans_cache.append(trans)
+        h = trans.dict_hash()
+        if h in self.trans_cache:
+            return
 
-    def make_trans(self, trans):
-        super().make_trans(trans)
+        # evict oldest transaction if cache is full
+        if len(self.trans_cache) >= MiningServer.TRANS_CACHE_MAX:
+            del self.trans_cache[next(iter(self.trans_cache))]
+
+        print(f'Transaction {h[0:12]} will be in next block.')
+        self.trans_cache[h] = trans
+
+    async def make_trans(self, trans):
+        await super().make_trans(trans)
         self.cache_trans(trans)
 
     async def update_block(self):
         # wait until block will be accepted or rejected
         while self.chain.get_block_confirms(self.block):
-            await asyncio.sleep(0)
+            self.block_settled.clear()
+            await self.block_settled.wait()
 
         # generate new block
         self.block = self.chain.new_block(self.usr.pub)
 
         # clear transactions queue
-        for trans in self.trans_cache:
+        for trans in self.trans_cache.values():
             self.chain.add_trans(self.block, trans)
         self.trans_cache.clear()
 
+    async def add_block_hlr(self, block_dict):
+        await super().add_block_hlr(block_dict)
+
+        # wake up block update
+        self.block_settled.set()
+
     def add_trans_hlr(self, trans_dict):
-        trans = from_dict(Transaction, trans_dict)
+        # drop gossip replays before parsing
+        key = hashlib.blake2b(orjson.dumps(trans_dict, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+        if key in self.trans_seen:
+            return
+
+        if len(self.trans_seen) >= MiningServer.TRANS_CACHE_MAX:
+            del self.trans_seen[next(iter(self.trans_seen))]
+        self.trans_seen[key] = None
+
+        trans = Transaction.from_dict(trans_dict)
         self.cache_trans(trans)
 
     async def serve_dispatch(self, data):
         await super().serve_dispatch(data)
 
         # add trans
-        if data.get('trans'):
-            self.add_trans_hlr(data['trans'])
+        if (trans := data.get('trans')) is not None:
+            self.add_trans_hlr(trans)
 
     async def serve_mining(self):
         while True:
@@ -207,64 +300,86 @@ class MiningServer(CoreServer):
                 reward_trans = Transaction(from_adr=None, to_adr=self.block.pow.solver, act=reward_act, hash=None, sign=None)
                 self.cache_trans(reward_trans)
 
-                await self.net.send({'trans': reward_trans.to_dict()})
-                await self.net.send({'block': self.block.to_dict()})
+                await asyncio.gather(
+                    self.net.send_raw(reward_trans.to_wire('trans')),
+                    self.net.send_raw(self.block.to_wire('block'))
+                )
 
+            # save blockchain while mining next block
             if self.chain.add_block(self.block):
-                await self._dict_to_disk(self.chain, 'blockchain.json')
+                task = asyncio.create_task(self._block_to_log(self.block, self.chain_log))
+                self.disk_tasks.add(task)
+                task.add_done_callback(self.disk_tasks.discard)
 
     async def serve_forever(self):
         loop = asyncio.get_running_loop()
-        loop.create_task(self.serve_mining())
+        self.mining = loop.create_task(self.serve_mining())
 
-        while True:
+        try:
             await super().serve_forever()
+        finally:
+            await asyncio.gather(*self.disk_tasks)
+            self.miner.shutdown()
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(prog='python3 pico-cli.py', description='PicoCoin core cli.')
-    parser.add_argument('--usr', type=str, default='user.json', help='path to user keys')
-    parser.add_argument('--chain', type=str, default='blockchain.json', help='path to blockchain')
-    parser.add_argument('--peers', type=str, default='peers.json', help='path to peers')
-    parser.add_argument('--mining', action='store_true', help='work as mining server')
-    parser.add_argument('--adr',  type=str, default='127.0.0.1', help='server listen address (default: "127.0.0.1")')
-    parser.add_argument('--trans', nargs=3, metavar=('to', 'act', 'args'), help='make a transaction')
-    parser.add_argument('--bal', action='store_true', help='get user balance')
-    parser.add_argument('--debg', action='store_true', help='debug mode (use with \'python3 -i\' flag)')
-
-    args = parser.parse_args()
-
+async def main(args):
     # init core server
-    serv = CoreServer() if not args.mining else MiningServer()
+    serv = CoreServer() if not args.mining else MiningServer(args.backend)
 
-    serv.usr_init(args.usr)
-    serv.chain_init(args.chain)
+    await serv.usr_init(args.usr)
+    await serv.chain_init(args.chain)
 
     # get balance
     if args.bal:
         print(f'Balance: {serv.chain.get_bal(serv.usr.pub)} picocoins.')
         if not args.mining:
-            exit()
+            return serv
 
-    serv.net_init(args.peers)
+    await serv.net_init(args.peers)
 
     # make transaction
     if args.trans:
         to = args.trans[0]
         act_args = args.trans[2]
 
-        act = {
-            'ivc': lambda: Invoice(int(act_args)),
-            'pay': lambda: Payment(int(act_args)),
-            'msg': lambda: Message(act_args)
-        }[args.trans[1]]()
+        act_ctor, act_parse = ACT_CTORS[args.trans[1]]
+        act = act_ctor(act_parse(act_args))
 
         trans = Transaction(from_adr=serv.usr.pub, to_adr=to, act=act, hash=None)
-        serv.make_trans(trans)
+        await serv.make_trans(trans)
 
         if not args.mining:
-            exit()
+            return serv
 
     # serve
     if not args.debg:
-        asyncio.run(serv.serve_forever())
+        await serv.serve_forever()
+    return serv
+
+
+if __name__ == '__main__':
+    # prefer faster event loop if available
+    try:
+        import uringcore
+        asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
+    except ImportError:
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
+
+    parser = argparse.ArgumentParser(prog='python3 pico-cli.py', description='PicoCoin core cli.')
+    parser.add_argument('--usr', type=str, default='user.json', help='path to user keys')
+    parser.add_argument('--chain', type=str, default='blockchain.json', help='path to blockchain')
+    parser.add_argument('--peers', type=str, default='peers.json', help='path to peers')
+    parser.add_argument('--mining', action='store_true', help='work as mining server')
+    parser.add_argument('--backend', type=str, default=MinerBackend.MINER_BACKEND_SYMPY_PROCESS, choices=(MinerBackend.MINER_BACKEND_SYMPY, MinerBackend.MINER_BACKEND_SYMPY_PROCESS), help=f'mining backend (default: "{MinerBackend.MINER_BACKEND_SYMPY_PROCESS}")')
+    parser.add_argument('--adr',  type=str, default='127.0.0.1', help='server listen address (default: "127.0.0.1")')
+    parser.add_argument('--trans', nargs=3, metavar=('to', 'act', 'args'), help='make a transaction')
+    parser.add_argument('--bal', action='store_true', help='get user balance')
+    parser.add_argument('--debg', action='store_true', help='debug mode (use with \'python3 -i\' flag)')
+
+    args = parser.parse_args()
+
+    serv = asyncio.run(main(args))
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import importlib.util
+
+from test_core import mined_block
+
+spec = importlib.util.spec_from_file_location('pico_cli', os.path.join(os.path.dirname(__file__), 'pico-cli.py'))
+pico_cli = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pico_cli)
+
+
+def test_chain_log_replay(tmp_path):
+    chain_path = str(tmp_path / 'chain.json')
+    block = mined_block()
+
+    async def run():
+        cli = pico_cli.CLI()
+        await cli.chain_init(chain_path)
+
+        await cli._block_to_log(block, cli.chain_log)
+        with open(cli.chain_log, 'ab') as f:
+            f.write(b'{"partial')
+
+        # replay folds log into blockchain file
+        cli = pico_cli.CLI()
+        await cli.chain_init(chain_path)
+        assert cli.chain.get_block(block.dict_hash()).dict_verify()
+        assert not (tmp_path / 'chain.json.log').exists()
+
+        cli = pico_cli.CLI()
+        await cli.chain_init(chain_path)
+        assert cli.chain.get_block(block.dict_hash()).dict_verify()
+
+        # log holding only a torn line is dropped, so next append starts clean
+        block_next = mined_block()
+        with open(cli.chain_log, 'ab') as f:
+            f.write(b'{"partial')
+
+        cli = pico_cli.CLI()
+        await cli.chain_init(chain_path)
+        assert not (tmp_path / 'chain.json.log').exists()
+
+        await cli._block_to_log(block_next, cli.chain_log)
+
+        cli = pico_cli.CLI()
+        await cli.chain_init(chain_path)
+        assert cli.chain.get_block(block_next.dict_hash()).dict_verify()
+
+    asyncio.run(run())
+
+
+
+def test_update_peers_hlr_dedup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pico_cli.Net, 'get_ipv6', lambda self: '::1')
+
+    sent = []
+
+    async def send(data_dict):
+        sent.append(data_dict)
+
+    serv = pico_cli.CoreServer()
+    serv.net = pico_cli.Net(hash=None)
+    serv.net.send = send
+
+    peers_dict = [{'ipv6': '::2', 'port': 10000}, {'ipv6': '::3', 'port': 10000}, {'ipv6': '::2', 'port': 10000}]
+    asyncio.run(serv.update_peers_hlr(peers_dict))
+
+    assert len(serv.net.peers) == 2
+    assert sent == [{'peers': peers_dict[0:2]}]
@@ -0,0 +1,76 @@
+import zlib
+import orjson
+import pytest
+
+from core import ProofOfWork, Block, Blockchain, Transaction, Reward, Net, Peer
+
+
+def mined_block():
+    chain = Blockchain(ver='0.1', blocks={}, hash=None)
+    block = chain.new_block('solver')
+
+    # numbers and primes wider than 64 bits, as produced by mining
+    num = block.pow.extract(0)
+    prime = 2 ** 89 - 1
+    block.add_pow(num, {prime: 1})
+    return block
+
+
+def test_block_wire_roundtrip():
+    block = mined_block()
+
+    data = orjson.loads(zlib.decompress(block.to_wire('block')))
+    block_rx = Block.from_dict(data['block'])
+
+    assert block_rx.dict_verify()
+    assert block_rx.dict_hash() == block.dict_hash()
+
+
+def test_to_wire_key():
+    block = mined_block()
+
+    assert orjson.loads(zlib.decompress(block.to_wire('block'))).keys() == {'block'}
+    assert orjson.loads(zlib.decompress(block.to_wire('other'))).keys() == {'other'}
+
+
+def test_pow_keys_match_json():
+    pow = ProofOfWork('solver')
+    pow.add_pow(2 ** 100 + 1, {2 ** 89 - 1: 2})
+
+    assert pow.defact(pow.work[str(2 ** 100 + 1)]) == (2 ** 89 - 1) ** 2
+
+
+def test_chain_disk_roundtrip():
+    block = mined_block()
+
+    chain = Blockchain(ver='0.1', blocks={block.dict_hash(): block}, hash=None)
+    data = orjson.dumps(chain.to_dict(), option=orjson.OPT_INDENT_2)
+    chain_rx = Blockchain.from_dict(orjson.loads(data))
+
+    assert chain_rx.get_block(block.dict_hash()).dict_verify()
+
+
+def test_trans_unknown_act():
+    trans_dict = {'from_adr': None, 'to_adr': 'x', 'act': {'foo': 1}, 'hash': None, 'sign': None, 'time': ''}
+
+    with pytest.raises(ValueError):
+        Transaction.from_dict(trans_dict)
+
+
+def test_trans_reward_roundtrip():
+    trans = Transaction(from_adr=None, to_adr='x', act=Reward(1.0, 'blk'), hash=None, sign=None)
+    trans_rx = Transaction.from_dict(orjson.loads(orjson.dumps(trans.to_dict())))
+
+    assert trans_rx.act == trans.act
+    assert trans_rx.dict_hash() == trans.dict_hash()
+
+
+def test_net_update_peers(monkeypatch):
+    monkeypatch.setattr(Net, 'get_ipv6', lambda self: '::1')
+    net = Net(hash=None)
+
+    peers = [Peer('::2', 10000), Peer('::3', 10000), Peer('::2', 10000)]
+
+    assert net.update_peers(peers)
+    assert net.peers == [Peer('::2', 10000), Peer('::3', 10000)]
+    assert not net.update_peers(peers)